@@ -2,14 +2,32 @@ import os
 import sys
 import json
 import csv
-from typing import Dict, List, Tuple
+from typing import Dict, List, Optional, Tuple
 from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import repeat
+import numpy as np
 import traci
+import traci.constants as tc
 from sumolib import checkBinary
 
+# In-process SUMO bindings (headless only), avoids the TraCI socket
+try:
+    import libsumo
+    LIBSUMO_AVAILABLE = True
+except ImportError:
+    LIBSUMO_AVAILABLE = False
+
+# libsumo raises its own exception type instead of traci's
+if LIBSUMO_AVAILABLE:
+    TRACI_ERRORS = (traci.exceptions.FatalTraCIError, libsumo.TraCIException)
+else:
+    TRACI_ERRORS = (traci.exceptions.FatalTraCIError,)
+
 # Optional imports for visualization
+# (Figure renders via the Agg canvas, no pyplot/GUI backend involved)
 try:
-    import matplotlib.pyplot as plt
+    from matplotlib.figure import Figure
     import matplotlib.patches as mpatches
     PLOTTING_AVAILABLE = True
 except ImportError:
@@ -23,27 +41,93 @@ except ImportError:
     print("⚠️  Pandas not available. Data export features limited.")
     PANDAS_AVAILABLE = False
 
+# Optional fast JSON encoder (falls back to stdlib json)
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+# Edge variables sampled every step via TraCI subscription
+EDGE_SUBSCRIPTION_VARS = [
+    tc.LAST_STEP_VEHICLE_NUMBER,
+    tc.LAST_STEP_MEAN_SPEED,
+    tc.LAST_STEP_OCCUPANCY,
+]
+
+# Per-edge record of one simulation step, in EDGE_SUBSCRIPTION_VARS order
+EDGE_STEP_DTYPE = np.dtype([
+    ('count', 'i8'),
+    ('speed', 'f8'),
+    ('occ', 'f8'),
+])
+
+# Intermediate visualization, overwritten by every snapshot of a run
+# (per run and process, so concurrent scenarios keep their snapshots apart)
+SNAPSHOT_FILENAME = "simulation_snapshot_{timestamp}_{pid}.png"
+
+# Running per-edge aggregates over all simulation steps
+# (sums stay 64-bit so long runs neither overflow nor drift)
+EDGE_AGG_DTYPE = np.dtype([
+    ('count_sum', 'i8'),
+    ('count_max', 'i8'),
+    ('speed_sum', 'f8'),
+    ('occ_sum', 'f8'),
+])
+
 
 class SUMOTrafficSimulator:
     """
      SUMO Traffic Simulator with analytics and visualization
     """
     
-    def __init__(self, config_path: str, gui_mode: bool = False):
+    __slots__ = (
+        'config_path', 'gui_mode', 'port', 'verbose', 'snapshot_interval',
+        'vehicle_travel_times', 'simulation_steps',
+        '_edge_ids', '_traci', '_agg', '_timestamp',
+    )
+    
+    def __init__(self, config_path: str, gui_mode: bool = False,
+                 port: Optional[int] = None, verbose: bool = False,
+                 snapshot_interval: Optional[int] = None):
         """
         Initialize the simulator
         
         Args:
             config_path: Path to SUMO configuration file
             gui_mode: Whether to run with GUI (True) or headless (False)
+            port: TraCI remote port (free port is chosen if None)
+            verbose: Whether to print progress during the simulation loop
+            snapshot_interval: Render intermediate results every this many
+                steps in a background thread (disabled if None)
         """
         self.config_path = config_path
         self.gui_mode = gui_mode
-        self.edge_counts = {}
-        self.edge_speeds = {}
-        self.edge_occupancy = {}
+        self.port = port
+        self.verbose = verbose
+        self.snapshot_interval = snapshot_interval
         self.vehicle_travel_times = {}
         self.simulation_steps = 0
+        # Shared by all output files of this run
+        self._timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        self._edge_ids = ()
+        self._traci = traci
+        
+        # Running per-edge aggregates (EDGE_AGG_DTYPE), one record per edge
+        self._agg = None
+    
+    def __getstate__(self):
+        """
+        Pickle support so finished simulators can be returned from workers
+        (the TraCI backend module itself cannot be pickled)
+        """
+        return {name: getattr(self, name) for name in self.__slots__
+                if name != '_traci'}
+    
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+        self._traci = traci
         
     def setup_sumo_environment(self, sumo_home: str = None):
         """
@@ -87,60 +171,140 @@ class SUMOTrafficSimulator:
             # Select binary
             sumoBinary = checkBinary('sumo-gui' if self.gui_mode else 'sumo')
             
+            # libsumo has no GUI, fall back to socket TraCI for sumo-gui
+            self._traci = libsumo if LIBSUMO_AVAILABLE and not self.gui_mode else traci
+            
             # Start TraCI
             print(f"\n🚀 Starting SUMO simulation...")
             print(f"   Configuration: {self.config_path}")
-            print(f"   Mode: {'GUI' if self.gui_mode else 'Headless'}\n")
+            print(f"   Mode: {'GUI' if self.gui_mode else 'Headless'}"
+                  f"{' (libsumo)' if self._traci is not traci else ''}\n")
             
-            traci.start([sumoBinary, "-c", self.config_path])
+            if self._traci is traci:
+                traci.start([sumoBinary, "-c", self.config_path], port=self.port)
+            else:
+                self._traci.start([sumoBinary, "-c", self.config_path])
             
-            # Main simulation loop
-            while traci.simulation.getMinExpectedNumber() > 0:
-                traci.simulationStep()
-                self._collect_step_data()
-                self.simulation_steps += 1
+            # Network topology is static: cache edge IDs and subscribe once,
+            # skipping internal junction edges (prefixed with ':')
+            self._edge_ids = tuple(
+                e for e in self._traci.edge.getIDList() if not e.startswith(':')
+            )
+            for edge_id in self._edge_ids:
+                self._traci.edge.subscribe(edge_id, EDGE_SUBSCRIPTION_VARS)
+            # Loop condition also comes back with each step response
+            self._traci.simulation.subscribe([tc.VAR_MIN_EXPECTED_VEHICLES])
+            self._reset_accumulators()
+            
+            # Main simulation loop: SUMO advances in a worker thread while
+            # the previous step's results are folded into the aggregates;
+            # snapshots render on a separate thread (one Figure each), at
+            # most one in flight so stale snapshots are dropped
+            snapshot_every = self.snapshot_interval if PLOTTING_AVAILABLE else None
+            snapshot_file = SNAPSHOT_FILENAME.format(
+                timestamp=self._timestamp, pid=os.getpid())
+            with ThreadPoolExecutor(max_workers=1) as stepper, \
+                    ThreadPoolExecutor(max_workers=1) as renderer:
+                # Bind hot-loop callables once to skip repeated attribute lookups
+                submit = stepper.submit
+                advance = self._advance
+                collect = self._collect_step_data
+                
+                pending = None
+                snapshot = None
+                remaining = self._traci.simulation.getMinExpectedNumber()
+                while remaining > 0:
+                    future = submit(advance)
+                    if pending is not None:
+                        collect(pending)
+                        # All steps counted so far are folded in at this point
+                        if (snapshot_every
+                                and self.simulation_steps % snapshot_every == 0
+                                and (snapshot is None or snapshot.done())):
+                            snapshot = renderer.submit(self.visualize_results,
+                                                       self._calculate_metrics(),
+                                                       snapshot_file,
+                                                       quiet=not self.verbose)
+                            snapshot.add_done_callback(self._report_snapshot_error)
+                    pending, remaining = future.result()
+                    self.simulation_steps += 1
+                    
+                    # Progress indicator (every 50 steps)
+                    if self.verbose and self.simulation_steps % 50 == 0:
+                        sys.stdout.write(f"⏱️  Step {self.simulation_steps}: "
+                                         f"{remaining} vehicles remaining\n")
                 
-                # Progress indicator (every 50 steps)
-                if self.simulation_steps % 50 == 0:
-                    print(f"⏱️  Step {self.simulation_steps}: "
-                          f"{traci.simulation.getMinExpectedNumber()} vehicles remaining")
+                if pending is not None:
+                    collect(pending)
             
             # Close TraCI
-            traci.close()
+            self._traci.close()
             
             print(f"\n✅ Simulation completed: {self.simulation_steps} steps\n")
             
             return self._calculate_metrics()
             
-        except traci.exceptions.FatalTraCIError as e:
+        except TRACI_ERRORS as e:
             print(f"❌ TraCI Error: {e}")
             raise
         except Exception as e:
             print(f"❌ Unexpected error: {e}")
             raise
     
-    def _collect_step_data(self):
+    def _reset_accumulators(self):
         """
-        Collect traffic data for current simulation step
+        Reset running per-edge aggregates for a new simulation run
+        
+        Only O(edges) state is kept; entry i belongs to self._edge_ids[i].
         """
-        for edge_id in traci.edge.getIDList():
-            # Vehicle count
-            vehicle_count = traci.edge.getLastStepVehicleNumber(edge_id)
-            if edge_id not in self.edge_counts:
-                self.edge_counts[edge_id] = []
-            self.edge_counts[edge_id].append(vehicle_count)
-            
-            # Average speed
-            avg_speed = traci.edge.getLastStepMeanSpeed(edge_id)
-            if edge_id not in self.edge_speeds:
-                self.edge_speeds[edge_id] = []
-            self.edge_speeds[edge_id].append(avg_speed)
-            
-            # Occupancy
-            occupancy = traci.edge.getLastStepOccupancy(edge_id)
-            if edge_id not in self.edge_occupancy:
-                self.edge_occupancy[edge_id] = []
-            self.edge_occupancy[edge_id].append(occupancy)
+        self._agg = np.zeros(len(self._edge_ids), dtype=EDGE_AGG_DTYPE)
+    
+    @staticmethod
+    def _report_snapshot_error(future):
+        """
+        Report a failed background snapshot render
+        
+        Args:
+            future: Completed render future
+        """
+        error = future.exception()
+        if error is not None:
+            print(f"❌ Failed to render snapshot: {error}")
+    
+    def _advance(self) -> Tuple[Dict[str, Dict[int, float]], int]:
+        """
+        Advance the simulation by one step and fetch subscription results
+        
+        Returns:
+            Subscribed edge variables for the new step and the number of
+            vehicles still expected in the simulation
+        """
+        sim = self._traci
+        # Subscribed values arrive with the step response, so the getters
+        # below read the client-side cache without further round-trips
+        sim.simulationStep()
+        # Copy: the TraCI client reuses its result cache on the next step
+        results = dict(sim.edge.getAllSubscriptionResults())
+        remaining = sim.simulation.getSubscriptionResults()[tc.VAR_MIN_EXPECTED_VEHICLES]
+        return results, remaining
+    
+    def _collect_step_data(self, results: Dict[str, Dict[int, float]]):
+        """
+        Fold traffic data of a simulation step into the running aggregates
+        
+        Args:
+            results: Subscription results returned by _advance
+        """
+        veh, spd, occ = EDGE_SUBSCRIPTION_VARS
+        values = [results[e] for e in self._edge_ids]
+        row = np.fromiter(((v[veh], v[spd], v[occ]) for v in values),
+                          dtype=EDGE_STEP_DTYPE, count=len(values))
+        
+        agg = self._agg
+        agg['count_sum'] += row['count']
+        np.maximum(agg['count_max'], row['count'], out=agg['count_max'])
+        agg['speed_sum'] += row['speed']
+        agg['occ_sum'] += row['occ']
     
     def _calculate_metrics(self) -> Dict[str, Dict[str, float]]:
         """
@@ -149,17 +313,27 @@ class SUMOTrafficSimulator:
         Returns:
             Dictionary with calculated metrics per edge
         """
-        metrics = {}
-        
-        for edge_id in self.edge_counts.keys():
-            metrics[edge_id] = {
-                'avg_vehicles': sum(self.edge_counts[edge_id]) / len(self.edge_counts[edge_id]),
-                'max_vehicles': max(self.edge_counts[edge_id]),
-                'avg_speed': sum(self.edge_speeds[edge_id]) / len(self.edge_speeds[edge_id]),
-                'avg_occupancy': sum(self.edge_occupancy[edge_id]) / len(self.edge_occupancy[edge_id])
-            }
+        if self.simulation_steps == 0:
+            return {}
+        
+        steps = self.simulation_steps
+        agg = self._agg
+        avg_vehicles = (agg['count_sum'] / steps).tolist()
+        max_vehicles = agg['count_max'].astype(int).tolist()
+        avg_speed = (agg['speed_sum'] / steps).tolist()
+        avg_occupancy = (agg['occ_sum'] / steps).tolist()
         
-        return metrics
+        return {
+            edge_id: {
+                'avg_vehicles': v_avg,
+                'max_vehicles': v_max,
+                'avg_speed': s_avg,
+                'avg_occupancy': o_avg
+            }
+            for edge_id, v_avg, v_max, s_avg, o_avg in zip(
+                self._edge_ids, avg_vehicles, max_vehicles,
+                avg_speed, avg_occupancy)
+        }
     
     def print_results(self, metrics: Dict[str, Dict[str, float]]):
         """
@@ -175,7 +349,7 @@ class SUMOTrafficSimulator:
         # Filter and sort by average vehicles
         significant_edges = {
             k: v for k, v in metrics.items() 
-            if not k.startswith(':') and v['avg_vehicles'] > 0.1
+            if v['avg_vehicles'] > 0.1
         }
         sorted_edges = sorted(
             significant_edges.items(), 
@@ -213,24 +387,32 @@ class SUMOTrafficSimulator:
             filename: Output filename (auto-generated if None)
         """
         if filename is None:
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            filename = f"simulation_results_{timestamp}.csv"
+            filename = f"simulation_results_{self._timestamp}.csv"
+        
+        fieldnames = ['edge_id', 'avg_vehicles', 'max_vehicles', 
+                      'avg_speed', 'avg_occupancy']
         
         try:
-            with open(filename, 'w', newline='') as csvfile:
-                fieldnames = ['edge_id', 'avg_vehicles', 'max_vehicles', 
-                             'avg_speed', 'avg_occupancy']
-                writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-                
-                writer.writeheader()
-                for edge_id, data in metrics.items():
-                    writer.writerow({
-                        'edge_id': edge_id,
-                        'avg_vehicles': data['avg_vehicles'],
-                        'max_vehicles': data['max_vehicles'],
-                        'avg_speed': data['avg_speed'],
-                        'avg_occupancy': data['avg_occupancy']
-                    })
+            if PANDAS_AVAILABLE:
+                # Vectorized C writer
+                df = pd.DataFrame.from_dict(
+                    metrics, orient='index', columns=fieldnames[1:])
+                # Same \r\n line endings as csv.DictWriter below
+                df.rename_axis('edge_id').reset_index().to_csv(
+                    filename, index=False, lineterminator='\r\n')
+            else:
+                with open(filename, 'w', newline='') as csvfile:
+                    writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
+                    
+                    writer.writeheader()
+                    for edge_id, data in metrics.items():
+                        writer.writerow({
+                            'edge_id': edge_id,
+                            'avg_vehicles': data['avg_vehicles'],
+                            'max_vehicles': data['max_vehicles'],
+                            'avg_speed': data['avg_speed'],
+                            'avg_occupancy': data['avg_occupancy']
+                        })
             
             print(f"💾 Results exported to: {filename}")
             
@@ -246,8 +428,7 @@ class SUMOTrafficSimulator:
             filename: Output filename (auto-generated if None)
         """
         if filename is None:
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            filename = f"simulation_results_{timestamp}.json"
+            filename = f"simulation_results_{self._timestamp}.json"
         
         try:
             export_data = {
@@ -259,20 +440,31 @@ class SUMOTrafficSimulator:
                 'edge_metrics': metrics
             }
             
-            with open(filename, 'w') as jsonfile:
-                json.dump(export_data, jsonfile, indent=2)
+            if ORJSON_AVAILABLE:
+                with open(filename, 'wb') as jsonfile:
+                    jsonfile.write(orjson.dumps(
+                        export_data,
+                        option=orjson.OPT_INDENT_2 | orjson.OPT_SERIALIZE_NUMPY
+                    ))
+            else:
+                with open(filename, 'w') as jsonfile:
+                    json.dump(export_data, jsonfile, indent=2)
             
             print(f"💾 Results exported to: {filename}")
             
         except Exception as e:
             print(f"❌ Failed to export JSON: {e}")
     
-    def visualize_results(self, metrics: Dict[str, Dict[str, float]]):
+    def visualize_results(self, metrics: Dict[str, Dict[str, float]], filename: str = None,
+                          dpi: int = 100, quiet: bool = False):
         """
         Create visualization plots of simulation results
         
         Args:
             metrics: Calculated metrics dictionary
+            filename: Output filename (auto-generated if None)
+            dpi: Resolution of the saved image
+            quiet: Suppress the confirmation message
         """
         if not PLOTTING_AVAILABLE:
             print("⚠️  Matplotlib not available. Skipping visualization.")
@@ -281,7 +473,7 @@ class SUMOTrafficSimulator:
         # Filter significant edges
         significant_edges = {
             k: v for k, v in metrics.items() 
-            if not k.startswith(':') and v['avg_vehicles'] > 0.1
+            if v['avg_vehicles'] > 0.1
         }
         
         # Sort by average vehicles
@@ -292,15 +484,16 @@ class SUMOTrafficSimulator:
         )
         
         edge_names = [e[0] for e in sorted_edges]
-        avg_vehicles = [e[1]['avg_vehicles'] for e in sorted_edges]
-        avg_speeds = [e[1]['avg_speed'] for e in sorted_edges]
+        avg_vehicles = np.array([e[1]['avg_vehicles'] for e in sorted_edges])
+        avg_speeds = np.array([e[1]['avg_speed'] for e in sorted_edges])
         
         # Create figure with subplots
-        fig, (ax1, ax2) = plt.subplots(2, 1, figsize=(12, 10))
+        fig = Figure(figsize=(12, 10))
+        ax1, ax2 = fig.subplots(2, 1)
         
         # Plot 1: Average Vehicles per Edge
-        colors = ['#e74c3c' if v > 3 else '#f39c12' if v > 2 else '#2ecc71' 
-                  for v in avg_vehicles]
+        colors = np.select([avg_vehicles > 3, avg_vehicles > 2],
+                           ['#e74c3c', '#f39c12'], default='#2ecc71')
         ax1.barh(edge_names, avg_vehicles, color=colors, alpha=0.7)
         ax1.set_xlabel('Average Vehicles', fontsize=12, fontweight='bold')
         ax1.set_ylabel('Edge ID', fontsize=12, fontweight='bold')
@@ -325,46 +518,95 @@ class SUMOTrafficSimulator:
                     label='Speed Limit (13.89 m/s)')
         ax2.legend()
         
-        plt.tight_layout()
+        fig.tight_layout()
         
         # Save figure
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f"simulation_visualization_{timestamp}.png"
-        plt.savefig(filename, dpi=300, bbox_inches='tight')
-        print(f"📊 Visualization saved to: {filename}")
-        
-        plt.show()
+        if filename is None:
+            filename = f"simulation_visualization_{self._timestamp}.png"
+        fig.savefig(filename, dpi=dpi, bbox_inches='tight')
+        if not quiet:
+            print(f"📊 Visualization saved to: {filename}")
 
 
-def main():
-    """
-    Main execution function
+# Configuration
+CONFIG_PATH = "simulation/sumo_config.sumocfg"
+SUMO_HOME = "C:/Program Files (x86)/Eclipse/Sumo"  # Adjust as needed
+DPI = 100  # Resolution of the saved visualization
+
+
+def _run_one(scenario: Tuple[str, Optional[int]], sumo_home: str,
+             gui_mode: bool = False, snapshot_interval: Optional[int] = None
+             ) -> Tuple['SUMOTrafficSimulator', Dict[str, Dict[str, float]]]:
     """
-    # Configuration
-    CONFIG_PATH = "simulation/sumo_config.sumocfg"
-    SUMO_HOME = "C:/Program Files (x86)/Eclipse/Sumo"  # Adjust as needed
+    Run a single scenario (top-level so it can be used by worker processes)
     
-    # Create simulator instance
+    Args:
+        scenario: (config_path, port) pair
+        sumo_home: Path to SUMO installation
+        gui_mode: Whether to run with GUI (True) or headless (False)
+        snapshot_interval: Steps between intermediate renders (None disables)
+    
+    Returns:
+        Finished simulator and its calculated metrics
+    """
+    config_path, port = scenario
     simulator = SUMOTrafficSimulator(
-        config_path=CONFIG_PATH,
-        gui_mode=False  # Set True to see visualization
+        config_path=config_path,
+        gui_mode=gui_mode,
+        port=port,
+        snapshot_interval=snapshot_interval
     )
-    
-    # Setup environment
-    simulator.setup_sumo_environment(SUMO_HOME)
-    
-    # Run simulation
+    simulator.setup_sumo_environment(sumo_home)
     metrics = simulator.run_simulation()
+    return simulator, metrics
+
+
+def main(scenarios: List[Tuple[str, Optional[int]]] = None,
+         gui_mode: bool = False, snapshot_interval: Optional[int] = None,
+         dpi: int = DPI):
+    """
+    Main execution function
     
-    # Display results
-    simulator.print_results(metrics)
+    Args:
+        scenarios: (config_path, port) pairs to simulate. Multiple scenarios
+            run concurrently, one SUMO instance per worker process
+        gui_mode: Set True to see visualization
+        snapshot_interval: Steps between intermediate renders (None disables)
+        dpi: Resolution of the saved visualization
+    """
+    if scenarios is None:
+        scenarios = [(CONFIG_PATH, None)]
     
-    # Export results
-    simulator.export_to_csv(metrics)
-    simulator.export_to_json(metrics)
+    # Run simulations
+    if len(scenarios) == 1:
+        results = [_run_one(scenarios[0], SUMO_HOME, gui_mode, snapshot_interval)]
+    else:
+        workers = min(len(scenarios), os.cpu_count() or 1)
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(
+                _run_one, scenarios, repeat(SUMO_HOME), repeat(gui_mode),
+                repeat(snapshot_interval)))
     
-    # Visualize (if matplotlib available)
-    simulator.visualize_results(metrics)
+    for i, (simulator, metrics) in enumerate(results):
+        # Keep output files of concurrent scenarios apart
+        if len(scenarios) > 1:
+            suffix = f"{i}_{simulator._timestamp}"
+            csv_file = f"simulation_results_{suffix}.csv"
+            json_file = f"simulation_results_{suffix}.json"
+            png_file = f"simulation_visualization_{suffix}.png"
+            print(f"\n🗂️  Scenario {i}: {simulator.config_path}")
+        else:
+            csv_file = json_file = png_file = None
+        
+        # Display results
+        simulator.print_results(metrics)
+        
+        # Export results
+        simulator.export_to_csv(metrics, csv_file)
+        simulator.export_to_json(metrics, json_file)
+        
+        # Visualize (if matplotlib available)
+        simulator.visualize_results(metrics, png_file, dpi=dpi)
     
     print("\n✨ Analysis complete!\n")
 